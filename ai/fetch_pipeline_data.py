@@ -6,6 +6,7 @@ Fetch data from backend APIs for the weighted heat risk pipeline.
 - POST /api/facilities/counts-by-barangays → facility count per barangay
 
 Writes CSV with columns: barangay_id, date, temperature, facility_distance.
+With --append, rows are added to a rolling-history CSV or a date-partitioned Parquet dataset.
 temperature: heat index °C when backend returns it (validated); else air temp °C.
 facility_distance = 1/(1+facility_count).
 
@@ -13,25 +14,95 @@ Requires: BACKEND_URL (e.g. http://localhost:3000)
 """
 
 import argparse
+import asyncio
+import hashlib
 import os
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
-def get_barangay_heat_data(base_url: str, timeout: int = 120) -> tuple[dict[str, float], bool, str]:
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "banasuno"
+
+# Backend endpoints (paths relative to BACKEND_URL)
+HEAT_PATH = "/api/heat/davao/barangays"
+FACILITY_COUNT_PATH_TMPL = "/api/facilities/by-barangay/{}"
+FACILITY_COUNTS_BATCH_PATH = "/api/facilities/counts-by-barangays"
+
+
+def create_session(pool_size: int = 20) -> requests.Session:
+    """
+    Shared HTTP session with keep-alive connection pooling (one pool slot per worker thread).
+    Retries connection failures and transient gateway errors (502/503/504) with a short backoff.
+    Read timeouts are not retried, so a slow heat call still fails after one --timeout.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, read=0, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def decode_json(r: requests.Response) -> dict:
+    """Decode a requests response body with orjson; a non-JSON body raises requests' JSONDecodeError (a RequestException) like r.json()."""
+    try:
+        return orjson.loads(r.content)
+    except orjson.JSONDecodeError as e:
+        raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos, response=r) from e
+
+
+def heat_cache_path(cache_dir: Path, base_url: str, day: str) -> Path:
+    """Cache file for the heat payload of one backend on one UTC day (new day = new file, so stale after midnight UTC)."""
+    key = hashlib.sha1(base_url.rstrip("/").encode("utf-8")).hexdigest()[:10]
+    return cache_dir / f"heat-{day}-{key}.json"
+
+
+def get_barangay_heat_data(
+    base_url: str,
+    timeout: int = 120,
+    session: requests.Session | None = None,
+    cache_file: Path | None = None,
+) -> tuple[dict[str, float], bool, str]:
     """
     Fetch GET /api/heat/davao/barangays. Uses heat_index_c when present (validated), else temp_c.
+    When cache_file is given, serve the payload from it if present; otherwise fetch and store it there.
     Returns (barangay_id -> temperature value, used_heat_index, temperatures_source).
     """
-    url = f"{base_url.rstrip('/')}/api/heat/davao/barangays"
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    data = r.json()
+    data = None
+    if cache_file is not None and cache_file.exists():
+        try:
+            data = orjson.loads(cache_file.read_bytes())
+            print(f"  Using cached heat data from {cache_file}", flush=True)
+        except (OSError, ValueError):
+            data = None
+    if data is None:
+        url = base_url.rstrip("/") + HEAT_PATH
+        r = (session or requests).get(url, timeout=timeout)
+        r.raise_for_status()
+        data = decode_json(r)
+        if cache_file is not None and data.get("barangays"):
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cache_file.with_suffix(".tmp")
+                tmp.write_bytes(r.content)
+                tmp.replace(cache_file)
+            except OSError as e:
+                print(f"  Could not write heat cache {cache_file}: {e}", file=sys.stderr)
     items = data.get("barangays") or []
     out: dict[str, float] = {}
     used_hi = False
@@ -42,39 +113,101 @@ def get_barangay_heat_data(base_url: str, timeout: int = 120) -> tuple[dict[str,
         risk = b.get("risk") or {}
         temp_c = b.get("temp_c")
         hi = risk.get("heat_index_c")
+        if not isinstance(bid, str):
+            bid = str(bid)
+        # orjson already decodes JSON numbers to float (or int for whole numbers); only coerce ints
         if isinstance(hi, (int, float)):
-            out[str(bid)] = float(hi)
+            out[bid] = hi if type(hi) is float else float(hi)
             used_hi = True
         elif isinstance(temp_c, (int, float)):
-            out[str(bid)] = float(temp_c)
+            out[bid] = temp_c if type(temp_c) is float else float(temp_c)
     meta = data.get("meta") or {}
     temperatures_source = meta.get("temperaturesSource") or "weatherapi"
     return out, used_hi, temperatures_source
 
 
-def get_facility_count(base_url: str, barangay_id: str) -> int:
-    """Fetch facility count for one barangay."""
-    url = f"{base_url.rstrip('/')}/api/facilities/by-barangay/{barangay_id}"
-    r = requests.get(url, timeout=15)
-    if r.status_code == 404:
-        return 0
-    r.raise_for_status()
-    data = r.json()
-    return int(data.get("total") or 0)
+async def get_facility_count(client: httpx.AsyncClient, barangay_id: str) -> tuple[str, int]:
+    """Fetch facility count for one barangay (client carries base_url). Returns (barangay_id, count); 0 on error."""
+    try:
+        r = await client.get(FACILITY_COUNT_PATH_TMPL.format(barangay_id))
+        if r.status_code == 404:
+            return barangay_id, 0
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        return barangay_id, int(data.get("total") or 0)
+    except (httpx.HTTPError, ValueError):
+        # ValueError: non-JSON body (JSONDecodeError) or a non-numeric total
+        return barangay_id, 0
+
+
+async def get_facility_counts_concurrent(
+    base_url: str, barangay_ids: list[str], max_connections: int = 20, timeout: int = 15
+) -> dict[str, int]:
+    """
+    Fetch facility counts per barangay concurrently on one event loop (fallback when batch is unavailable).
+    Uses HTTP/2 when the server negotiates it (many requests multiplexed over one connection).
+    """
+    limits = httpx.Limits(max_connections=max_connections)
+    counts: dict[str, int] = {}
+    n = len(barangay_ids)
+    async with httpx.AsyncClient(http2=True, base_url=base_url, timeout=timeout, limits=limits) as client:
+        tasks = [get_facility_count(client, bid) for bid in barangay_ids]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            barangay_id, count = await task
+            counts[barangay_id] = count
+            if done % 50 == 0 or done == n:
+                print(f"  {done}/{n} facility counts...", flush=True)
+    return counts
+
+
+def get_facility_counts_batch(
+    base_url: str,
+    barangay_ids: list[str],
+    timeout: int = 60,
+    session: requests.Session | None = None,
+    chunk_size: int = 200,
+    max_workers: int = 8,
+) -> dict[str, int]:
+    """
+    Fetch facility counts via the batch endpoint (faster). Returns { barangay_id: count }.
+    IDs are sent in chunks of chunk_size (bounded request size), posted concurrently and merged.
+    """
+    url = base_url.rstrip("/") + FACILITY_COUNTS_BATCH_PATH
+    http = session or requests
+    ids = list(barangay_ids)
+    chunks = [ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+    def post_chunk(chunk: list[str]) -> dict[str, int]:
+        r = http.post(url, json={"barangayIds": chunk}, timeout=timeout)
+        r.raise_for_status()
+        data = decode_json(r)
+        counts = data.get("counts") or {}
+        # JSON object keys are always str; values are normally ints already
+        if all(type(v) is int for v in counts.values()):
+            return counts
+        return {k: int(v) for k, v in counts.items()}
+
+    out: dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        for partial in executor.map(post_chunk, chunks):
+            out.update(partial)
+    return out
+
+
+def is_parquet_history(path: Path) -> bool:
+    """History store is a partitioned Parquet dataset when the path ends in .parquet or is an existing directory."""
+    return path.suffix == ".parquet" or path.is_dir()
 
 
-def get_facility_counts_batch(base_url: str, barangay_ids: list[str], timeout: int = 60) -> dict[str, int]:
-    """Fetch facility counts for many barangays in one request (faster). Returns { barangay_id: count }."""
-    url = f"{base_url.rstrip('/')}/api/facilities/counts-by-barangays"
-    r = requests.post(url, json={"barangayIds": list(barangay_ids)}, timeout=timeout)
-    r.raise_for_status()
-    data = r.json()
-    counts = data.get("counts") or {}
-    return {str(k): int(v) for k, v in counts.items()}
+def write_csv(df: pd.DataFrame, path: Path, append: bool = False) -> None:
+    """Write df as CSV with pyarrow's native writer (header only when not appending)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with open(path, "ab" if append else "wb") as f:
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=not append))
 
 
-def facility_count_to_distance(facility_count: int) -> float:
-    """Convert facility count to a risk proxy: fewer facilities = higher value (like distance)."""
+def facility_count_to_distance(facility_count: int | np.ndarray) -> float | np.ndarray:
+    """Convert facility count to a risk proxy: fewer facilities = higher value (like distance). Works elementwise on arrays."""
     return 1.0 / (1.0 + facility_count)
 
 
@@ -87,8 +220,8 @@ def main() -> int:
     )
     parser.add_argument(
         "--append",
-        metavar="CSV",
-        help="Append today's rows to this CSV (e.g. barangay_data.csv) for rolling history",
+        metavar="PATH",
+        help="Append today's rows for rolling history: CSV (e.g. barangay_data.csv) or partitioned Parquet dataset (e.g. barangay_data.parquet)",
     )
     parser.add_argument(
         "--backend",
@@ -107,17 +240,32 @@ def main() -> int:
         default=20,
         help="Concurrent requests for facility counts (default 20)",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("BANASUNO_CACHE_DIR", str(DEFAULT_CACHE_DIR)),
+        help="Directory for same-day heat API cache (default: BANASUNO_CACHE_DIR or ~/.cache/banasuno)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch heat data from the backend (ignore and do not write the same-day cache)",
+    )
     args = parser.parse_args()
 
     base_url = args.backend.rstrip("/")
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    # One pooled session shared by all requests (and worker threads): reuses TCP/TLS connections
+    session = create_session(pool_size=args.workers)
+    cache_file = None if args.no_cache else heat_cache_path(Path(args.cache_dir), base_url, today)
 
     print(f"Requesting heat data from {base_url} (timeout={args.timeout}s) ...", flush=True)
     temperatures: dict[str, float] = {}
     used_heat_index = False
     temperatures_source = ""
     try:
-        temperatures, used_heat_index, temperatures_source = get_barangay_heat_data(base_url, timeout=args.timeout)
+        temperatures, used_heat_index, temperatures_source = get_barangay_heat_data(
+            base_url, timeout=args.timeout, session=session, cache_file=cache_file
+        )
     except requests.RequestException as e:
         print(f"Error fetching heat data: {e}", file=sys.stderr)
         return 1
@@ -126,7 +274,7 @@ def main() -> int:
         print("No barangay temperatures returned from API.", file=sys.stderr)
         return 1
 
-    print("  Using temperatures from GET /api/heat/davao/barangays.", flush=True)
+    print(f"  Using temperatures from GET {HEAT_PATH}.", flush=True)
     if used_heat_index:
         print("  Heat index (validated) used as temperature.", flush=True)
 
@@ -137,54 +285,64 @@ def main() -> int:
     facility_counts: dict[str, int] = {}
     try:
         print(f"Fetched temperatures for {n} barangays. Fetching facility counts (batch)...", flush=True)
-        facility_counts = get_facility_counts_batch(base_url, barangay_ids)
+        facility_counts = get_facility_counts_batch(base_url, barangay_ids, session=session)
         if len(facility_counts) < n:
             for bid in barangay_ids:
                 if bid not in facility_counts:
                     facility_counts[bid] = 0
     except requests.RequestException as e:
-        print(f"  Batch not available ({e}), using {args.workers} parallel requests...", flush=True)
-        def fetch_one(bid: str) -> tuple[str, int]:
-            try:
-                return (bid, get_facility_count(base_url, bid))
-            except requests.RequestException:
-                return (bid, 0)
-
-        done = 0
-        with ThreadPoolExecutor(max_workers=args.workers) as executor:
-            futures = {executor.submit(fetch_one, bid): bid for bid in barangay_ids}
-            for future in as_completed(futures):
-                barangay_id, count = future.result()
-                facility_counts[barangay_id] = count
-                done += 1
-                if done % 50 == 0 or done == n:
-                    print(f"  {done}/{n} facility counts...", flush=True)
-
-    rows = [
+        print(f"  Batch not available ({e}), using {args.workers} concurrent requests...", flush=True)
+        facility_counts = asyncio.run(
+            get_facility_counts_concurrent(base_url, barangay_ids, max_connections=args.workers)
+        )
+
+    # Build columns as arrays (one vectorized pass) instead of one dict per barangay
+    temps = np.fromiter(temperatures.values(), dtype=np.float64, count=n)
+    counts = np.fromiter((facility_counts.get(bid, 0) for bid in barangay_ids), dtype=np.int32, count=n)
+    df = pd.DataFrame(
         {
-            "barangay_id": barangay_id,
+            "barangay_id": barangay_ids,
             "date": today,
-            "temperature": round(temp, 2),
-            "facility_distance": round(facility_count_to_distance(facility_counts.get(barangay_id, 0)), 6),
+            "temperature": temps,
+            "facility_distance": facility_count_to_distance(counts),
         }
-        for barangay_id, temp in temperatures.items()
-    ]
-
-    df = pd.DataFrame(rows)
+    )
+    # Round once per column (2 dp temperature, 6 dp distance) so CSV and Parquet history store the same values.
+    # Vectorized rounding is not correctly rounded like Python's round(): values near a half-way point can
+    # differ in the last digit (0.01 °C / 1e-6) from the old per-row output; negligible for the pipeline.
+    df = df.round({"temperature": 2, "facility_distance": 6})
 
-    if args.append:
+    if args.append and is_parquet_history(Path(args.append)):
+        append_path = Path(args.append)
+        # Partitioned dataset: today's rows go to <path>/date=YYYY-MM-DD/; history is not read or rewritten.
+        # A same-day re-run replaces that day's partition instead of duplicating it.
+        df.to_parquet(
+            append_path,
+            engine="pyarrow",
+            index=False,
+            partition_cols=["date"],
+            existing_data_behavior="delete_matching",
+        )
+        print(f"Appended {n} rows to {append_path} (parquet, date={today})", flush=True)
+    elif args.append:
         append_path = Path(args.append)
-        if append_path.exists():
+        header = list(pd.read_csv(append_path, nrows=0).columns) if append_path.exists() else None
+        if header is not None and not set(df.columns) <= set(header):
+            # One-time migration: existing history lacks some of today's columns, so rewrite it with the new header
             existing = pd.read_csv(append_path)
             for c in df.columns:
                 if c not in existing.columns:
                     existing[c] = pd.NA
-            df = pd.concat([existing, df], ignore_index=True)
-        df.to_csv(append_path, index=False)
-        print(f"Appended {len(rows)} rows to {append_path}", flush=True)
+            pd.concat([existing, df], ignore_index=True).to_csv(append_path, index=False)
+        else:
+            # Append only today's rows (in the file's column order); history is not re-read or rewritten
+            if header is not None:
+                df = df.reindex(columns=header)
+            write_csv(df, append_path, append=header is not None)
+        print(f"Appended {n} rows to {append_path}", flush=True)
     else:
-        df.to_csv(args.output, index=False)
-        print(f"Wrote {len(rows)} rows to {args.output}", flush=True)
+        write_csv(df, Path(args.output))
+        print(f"Wrote {n} rows to {args.output}", flush=True)
 
     return 0
 
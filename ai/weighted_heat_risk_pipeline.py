@@ -26,12 +26,79 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from sklearn.cluster import KMeans
-from sklearn.preprocessing import MinMaxScaler
 
 
-def load_data(path: str) -> pd.DataFrame:
-    """Load CSV with required columns: barangay_id, date, temperature, facility_distance (or facility_score). Optional columns (e.g. population, density) are ignored."""
-    df = pd.read_csv(path)
+# Known CSV schema: skips pandas' per-column type inference. Keys for absent columns are ignored.
+# Dates stay ISO YYYY-MM-DD strings (sortable, comparable with history cutoffs); IDs stay strings (keeps leading zeros).
+# Floats stay float64 so rolling means keep full precision; prepare_features downcasts the feature matrix to float32.
+CSV_DTYPES = {
+    "barangay_id": "str",
+    "date": "str",
+    "temperature": "float64",
+    "facility_distance": "float64",
+    "facility_score": "float64",
+}
+
+
+def history_cutoff(dates, history_days: int) -> str | None:
+    """
+    Oldest date to keep so that the history_days most recent distinct dates are loaded (dates: iterable of YYYY-MM-DD).
+    Counts observed dates, not calendar days, so gaps in the history do not shrink the rolling window. None = keep all.
+    """
+    recent = sorted(set(dates))[-history_days:]
+    return recent[0] if len(recent) == history_days else None
+
+
+def _read_parquet_tail(path: Path, history_days: int | None) -> pd.DataFrame:
+    """Read Parquet file/dataset; with history_days, push a date filter down so older row groups/partitions are skipped."""
+    if not history_days:
+        return pd.read_parquet(path, engine="pyarrow")
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    if "date" not in dataset.schema.names:
+        return pd.read_parquet(path, engine="pyarrow")
+    dates = pc.unique(dataset.to_table(columns=["date"])["date"]).to_pylist()
+    cutoff = history_cutoff((str(d) for d in dates if d is not None), history_days)
+    if cutoff is None:
+        return pd.read_parquet(path, engine="pyarrow")
+    return pd.read_parquet(path, engine="pyarrow", filters=[("date", ">=", cutoff)])
+
+
+def _read_csv_tail(path: Path, history_days: int | None, chunksize: int = 200_000) -> pd.DataFrame:
+    """Read CSV; with history_days, stream it in chunks and keep only rows from the history_days most recent dates."""
+    if not history_days or "date" not in pd.read_csv(path, nrows=0).columns:
+        return pd.read_csv(path, dtype=CSV_DTYPES)
+    kept: list[pd.DataFrame] = []
+    recent: list[str] = []  # the (at most) history_days most recent distinct dates seen so far
+    cutoff = None
+    for chunk in pd.read_csv(path, dtype=CSV_DTYPES, chunksize=chunksize):
+        recent = sorted(set(recent).union(chunk["date"].dropna().unique()))[-history_days:]
+        new_cutoff = history_cutoff(recent, history_days)
+        if new_cutoff is not None and new_cutoff != cutoff:
+            # The cutoff only moves forward, so rows dropped here are never needed again
+            cutoff = new_cutoff
+            kept = [k[k["date"] >= cutoff] for k in kept]
+        kept.append(chunk if cutoff is None else chunk[chunk["date"] >= cutoff])
+    return pd.concat(kept, ignore_index=True)
+
+
+def load_data(path: str, history_days: int | None = None) -> pd.DataFrame:
+    """
+    Load CSV or Parquet history (file or date-partitioned dataset) with required columns: barangay_id, date, temperature, facility_distance (or facility_score). Optional columns (e.g. population, density) are ignored.
+    history_days: keep only rows from the N most recent distinct dates in the file; None or 0 loads everything.
+    """
+    if history_days is not None and history_days < 0:
+        raise ValueError(f"history_days must be >= 0, got {history_days}")
+    p = Path(path)
+    if p.suffix == ".parquet" or p.is_dir():
+        df = _read_parquet_tail(p, history_days)
+        # Partition column comes back as categorical; keep dates as YYYY-MM-DD strings like the CSV path
+        if "date" in df.columns:
+            df["date"] = df["date"].astype(str)
+    else:
+        df = _read_csv_tail(p, history_days)
     for col in ["barangay_id", "date", "temperature", "facility_distance"]:
         if col not in df.columns and col != "facility_distance":
             raise ValueError(f"Missing required column: {col}")
@@ -50,12 +117,20 @@ def prepare_features(
     """
     Compute rolling (or raw) features and scaled feature matrix.
     Returns (df with new columns, features_scaled, feature_names, weights).
+    The returned df is a new sorted frame (sort_values already copies); the input is not modified.
     """
-    df = df.sort_values(["barangay_id", "date"]).copy()
+    df = df.sort_values(["barangay_id", "date"], kind="mergesort", ignore_index=True)
 
-    if use_rolling and df["date"].nunique() > 1:
-        df["temp_rolling"] = df.groupby("barangay_id")["temperature"].transform(
-            lambda x: x.rolling(window=window, min_periods=1).mean()
+    # More than one date? One vectorized compare against the first date (nunique builds a hash table).
+    # First vs last row is not a valid proxy: the frame is sorted by barangay first.
+    multi_day = len(df) > 0 and bool((df["date"] != df["date"].iat[0]).any())
+    if use_rolling and multi_day:
+        # Native groupby-rolling (no per-group Python lambda); frame is already sorted, so skip the groupby sort
+        df["temp_rolling"] = (
+            df.groupby("barangay_id", sort=False)["temperature"]
+            .rolling(window=window, min_periods=1)
+            .mean()
+            .reset_index(level=0, drop=True)
         )
     else:
         df["temp_rolling"] = df["temperature"]
@@ -66,10 +141,14 @@ def prepare_features(
     feature_cols = ["temp_rolling", "facility_score"]
     weights = np.array([0.5, 0.5])  # Equal weight approach (EWA), validated
 
-    features = df[feature_cols].copy()
+    # float32 halves memory traffic for the N x 2 matrix; scaling and KMeans keep the dtype
+    features = df[feature_cols].astype(np.float32)
     features = features.fillna(features.mean(numeric_only=True))
-    scaler = MinMaxScaler()
-    features_scaled = scaler.fit_transform(features)
+    # Min-max scale each column to [0, 1] (same as sklearn MinMaxScaler; constant column -> 0)
+    X = features.to_numpy(dtype=np.float32)
+    mn = X.min(axis=0)
+    rng = X.max(axis=0) - mn
+    features_scaled = (X - mn) / np.where(rng == 0, 1, rng)
 
     return df, features_scaled, feature_cols, weights
 
@@ -81,16 +160,53 @@ def run_kmeans_and_risk_levels(
     weights: np.ndarray,
     n_clusters: int = 5,
     random_state: int = 42,
+    centroids_path: str | None = None,
 ) -> pd.DataFrame:
-    """Assign clusters and map to PAGASA risk levels 1–5 by weighted severity."""
-    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
-    df = df.copy()
+    """
+    Assign clusters and map to PAGASA risk levels 1–5 by weighted severity. Adds cluster/risk_level to df in place and returns it.
+    centroids_path: .npy file of previous cluster centers; when present (and shaped k x features) K-Means warm-starts
+    from it, and the fitted centers are saved back to it for the next run.
+    """
+    init_centroids = None
+    if centroids_path and Path(centroids_path).exists():
+        try:
+            init_centroids = np.load(centroids_path)
+        except (OSError, ValueError) as e:
+            print(f"  Ignoring centroids {centroids_path}: {e}", file=sys.stderr)
+        if init_centroids is not None and init_centroids.shape != (n_clusters, features_scaled.shape[1]):
+            print(f"  Ignoring centroids {centroids_path}: shape {init_centroids.shape} does not match", file=sys.stderr)
+            init_centroids = None
+
+    if init_centroids is not None:
+        # Warm start: yesterday's centers are already near today's optimum, so one init converges in a few iterations
+        kmeans = KMeans(
+            n_clusters=n_clusters, init=init_centroids.astype(features_scaled.dtype), n_init=1, random_state=random_state
+        )
+    else:
+        # n_init="auto" = one k-means++ run (default from scikit-learn 1.4; 1.3 would otherwise run 10 inits)
+        kmeans = KMeans(n_clusters=n_clusters, n_init="auto", random_state=random_state)
     df["cluster"] = kmeans.fit_predict(features_scaled)
+    if centroids_path:
+        # Write through a file handle so np.save does not append ".npy" to a differently named path
+        try:
+            with open(centroids_path, "wb") as f:
+                np.save(f, kmeans.cluster_centers_)
+        except OSError as e:
+            print(f"  Could not save centroids {centroids_path}: {e}", file=sys.stderr)
 
-    cluster_means = df.groupby("cluster")[feature_cols].mean()
-    cluster_means["severity_score"] = cluster_means.dot(weights)
-    cluster_rank = cluster_means["severity_score"].rank(method="first", ascending=True).astype(int).to_dict()
-    df["risk_level"] = df["cluster"].map(lambda x: int(cluster_rank[x]))
+    # Per-cluster mean of each scaled feature via bincount (no groupby hash table), then EWA severity
+    labels = df["cluster"].to_numpy()
+    counts = np.bincount(labels, minlength=n_clusters)
+    sums = np.stack(
+        [np.bincount(labels, weights=features_scaled[:, i], minlength=n_clusters) for i in range(len(feature_cols))],
+        axis=1,
+    )
+    present = counts > 0
+    severity = (sums[present] / counts[present, None]) @ weights
+    # Rank ascending (ties by cluster id) -> risk level 1..k; empty clusters stay 0 and are never indexed
+    rank_array = np.zeros(n_clusters, dtype=np.int32)
+    rank_array[present] = np.argsort(np.argsort(severity, kind="stable"), kind="stable") + 1
+    df["risk_level"] = rank_array[labels]
 
     return df
 
@@ -100,7 +216,7 @@ def main() -> int:
     parser.add_argument(
         "--input",
         default="barangay_data.csv",
-        help="Input CSV (barangay_id, date, temperature, facility_distance)",
+        help="Input CSV or Parquet history (barangay_id, date, temperature, facility_distance)",
     )
     parser.add_argument(
         "--output",
@@ -113,7 +229,18 @@ def main() -> int:
         help="Use raw values instead of 7-day rolling (e.g. single-day data)",
     )
     parser.add_argument("--window", type=int, default=7, help="Rolling window size (default 7)")
+    parser.add_argument(
+        "--history-days",
+        type=int,
+        default=None,
+        help="Load only rows from the N most recent distinct dates of the input (default: --window; 0 = full history)",
+    )
     parser.add_argument("--clusters", type=int, default=5, help="K-Means clusters (default 5)")
+    parser.add_argument(
+        "--centroids",
+        metavar="NPY",
+        help="Warm-start K-Means from cluster centers saved in this .npy file by the previous run (created if missing)",
+    )
     parser.add_argument(
         "--upload",
         action="store_true",
@@ -125,6 +252,8 @@ def main() -> int:
         help="When used with --upload: do not write report to local file (report only in backend/Supabase)",
     )
     args = parser.parse_args()
+    if args.history_days is not None and args.history_days < 0:
+        parser.error("--history-days must be >= 0")
 
     input_path = Path(args.input)
     if not input_path.exists():
@@ -132,12 +261,13 @@ def main() -> int:
         return 1
 
     print(f"Loading {input_path} and running pipeline...", flush=True)
-    df = load_data(str(input_path))
+    history_days = args.window if args.history_days is None else args.history_days
+    df = load_data(str(input_path), history_days=history_days)
     df, features_scaled, feature_cols, weights = prepare_features(
         df, use_rolling=not args.no_rolling, window=args.window
     )
     df = run_kmeans_and_risk_levels(
-        df, features_scaled, feature_cols, weights, n_clusters=args.clusters
+        df, features_scaled, feature_cols, weights, n_clusters=args.clusters, centroids_path=args.centroids
     )
 
     latest_date = df["date"].max()